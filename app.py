@@ -6,8 +6,9 @@ from flask import Flask
 
 from config import Config
 from service.github import github
+from service.webhook import webhooks
 from models.db import db
-from views import eventbp
+from views import eventbp, store_feed_events
 
 # Logging
 logger = logging.getLogger(__name__)
@@ -27,12 +28,21 @@ if not app.config.get('GITHUB_CLIENT_ID') or not app.config.get('GITHUB_CLIENT_S
 github.client_id = app.config['GITHUB_CLIENT_ID']
 github.client_secret = app.config['GITHUB_CLIENT_SECRET']
 
+# GitHub webhooks
+if not app.config.get('GITHUB_WEBHOOK_SECRET'):
+    logger.warning(
+        'Set GITHUB_WEBHOOK_SECRET in .env or environment variables to accept webhook deliveries')
+webhooks.secret = app.config['GITHUB_WEBHOOK_SECRET']
+webhooks.batch_size = app.config['WEBHOOK_BATCH_SIZE']
+webhooks.queue_size = app.config['WEBHOOK_QUEUE_SIZE']
+
 # SQLAlchemy (needs to be run on import for pythonanywhere)
 db.app = app
 db.init_app(app)
 # create database tables for models
 with app.app_context():
     db.create_all()
+webhooks.start(app, store_feed_events)
 
 
 @app.template_filter()
@@ -18,6 +18,9 @@ class Config(object):
     SECRET_KEY = os.getenv('SECRET_KEY') or b'#&TGafg7(@0\\'
     GITHUB_CLIENT_ID = os.getenv('GITHUB_CLIENT_ID')
     GITHUB_CLIENT_SECRET = os.getenv('GITHUB_CLIENT_SECRET')
+    GITHUB_WEBHOOK_SECRET = os.getenv('GITHUB_WEBHOOK_SECRET')
+    WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE') or 1000)
+    WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE') or 100)
     DEBUG = os.getenv('DEBUG') == '1'
     SQLALCHEMY_DATABASE_URI = os.getenv(
         'SQLALCHEMY_DATABASE_URI') or 'sqlite:///' + os.path.join(basedir, 'data.db')
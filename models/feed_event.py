@@ -0,0 +1,31 @@
+from .db import db
+from .user import User
+
+
+class FeedEvent(db.Model):
+    '''
+    Stores a webhook event, normalized to the GitHub activity API v3 format,
+    in the feed of a subscribed user. Each user's copy has its own event id.
+    '''
+
+    __tablename__ = 'feed_events'
+    __table_args__ = (db.UniqueConstraint('event_id', 'github_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(120), index=True)
+    event_json = db.Column(db.JSON)
+    github_id = db.Column(
+        db.Integer, db.ForeignKey(User.github_id), index=True)
+    created_at = db.Column(db.DateTime, index=True)
+
+    def __init__(self, event_id, event_json, github_id, created_at):
+        self.event_id = event_id
+        self.event_json = event_json
+        self.github_id = github_id
+        self.created_at = created_at
+
+    def __repr__(self):
+        return '<FeedEvent {} {} {}>'.format(
+            self.event_id,
+            self.github_id,
+            self.event_json)
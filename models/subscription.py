@@ -0,0 +1,26 @@
+from .db import db
+from .user import User
+
+
+class Subscription(db.Model):
+    '''
+    Subscribes a user to webhook events from a GitHub repository ('owner/repo')
+    or organization ('org'). Targets are stored lowercase.
+    '''
+
+    __tablename__ = 'subscriptions'
+    __table_args__ = (db.UniqueConstraint('github_id', 'target'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    github_id = db.Column(
+        db.Integer, db.ForeignKey(User.github_id), index=True)
+    target = db.Column(db.String(140), index=True)
+
+    def __init__(self, github_id, target):
+        self.github_id = github_id
+        self.target = target
+
+    def __repr__(self):
+        return '<Subscription {} {}>'.format(
+            self.github_id,
+            self.target)
@@ -0,0 +1,67 @@
+"""
+Replays recorded GitHub webhook deliveries against a running app.
+
+Each delivery is a JSON file with the request 'headers' and 'body'. The body is
+signed with GITHUB_WEBHOOK_SECRET (from .env or the environment) and POSTed to
+the webhook endpoint.
+
+    python scripts/replay_webhooks.py scripts/deliveries
+    python scripts/replay_webhooks.py --url http://localhost:5000/webhook scripts/deliveries/push.json
+"""
+import os
+import sys
+import hmac
+import json
+import hashlib
+import argparse
+import requests
+
+basedir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(basedir, '.env'))
+except Exception:
+    print("Failed to load dotenv!", file=sys.stderr)
+    pass
+
+
+def delivery_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.json'):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def replay(path: str, url: str, secret: str) -> requests.models.Response:
+    with open(path) as f:
+        delivery = json.load(f)
+    body = json.dumps(delivery['body']).encode('utf-8')
+    headers = dict(delivery.get('headers', {}))
+    headers['Content-Type'] = 'application/json'
+    headers['X-Hub-Signature-256'] = 'sha256=' + hmac.new(
+        secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return requests.post(url, data=body, headers=headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='+', help='delivery JSON files or directories of them')
+    parser.add_argument('--url', default='http://localhost:5000/webhook', help='webhook endpoint')
+    args = parser.parse_args()
+
+    secret = os.getenv('GITHUB_WEBHOOK_SECRET')
+    if not secret:
+        print('Set GITHUB_WEBHOOK_SECRET in .env or environment variables', file=sys.stderr)
+        sys.exit(-1)
+
+    for path in delivery_files(args.paths):
+        response = replay(path, args.url, secret)
+        print("%s %s %s" % (path, response.status_code, response.text.strip()))
+
+
+if __name__ == "__main__":
+    main()
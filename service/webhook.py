@@ -0,0 +1,313 @@
+import re
+import hmac
+import queue
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+'''
+Maps webhook event names (the X-GitHub-Event header) to the event types used by
+the activity API, i.e. the keys of github_event_templates.
+
+Follow and gist events have no webhook equivalent.
+
+See: https://developer.github.com/webhooks/event-payloads/
+'''
+WEBHOOK_EVENT_TYPES = {
+    'commit_comment': 'CommitCommentEvent',
+    'create': 'CreateEvent',
+    'delete': 'DeleteEvent',
+    'fork': 'ForkEvent',
+    'gollum': 'GollumEvent',
+    'issue_comment': 'IssueCommentEvent',
+    'issues': 'IssuesEvent',
+    'member': 'MemberEvent',
+    'public': 'PublicEvent',
+    'pull_request': 'PullRequestEvent',
+    'pull_request_review_comment': 'PullRequestReviewCommentEvent',
+    'push': 'PushEvent',
+    'release': 'ReleaseEvent',
+    'watch': 'WatchEvent',
+}
+
+'''
+Webhook actions that the activity API reports for each event, other actions
+(e.g. 'synchronize' pull requests, or 'created' and 'released' releases, which
+are delivered alongside 'published') are dropped. Events not listed here have
+no action.
+'''
+WEBHOOK_EVENT_ACTIONS = {
+    'commit_comment': ('created',),
+    'issue_comment': ('created',),
+    'issues': ('opened', 'closed', 'reopened'),
+    'member': ('added',),
+    'pull_request': ('opened', 'closed', 'reopened'),
+    'pull_request_review_comment': ('created',),
+    'release': ('published',),
+    'watch': ('started',),
+}
+
+# Payload timestamps of when the event happened, in order of preference
+WEBHOOK_EVENT_TIMESTAMPS = (
+    ('comment', 'created_at'),
+    ('issue', 'updated_at'),
+    ('pull_request', 'updated_at'),
+    ('release', 'published_at'),
+    ('head_commit', 'timestamp'),
+    ('forkee', 'created_at'),
+)
+
+# Top-level webhook payload keys that the activity API moves out of the payload
+WEBHOOK_ENVELOPE_KEYS = ('sender', 'repository', 'organization', 'installation', 'enterprise')
+
+# Subscription targets: 'owner' or 'owner/repo', see GitHubAPI.validate_username
+SUBSCRIPTION_TARGET_PATTERN = re.compile(
+    r"^[a-z\d](?:[a-z\d]|-(?=[a-z\d])){0,38}(?:/[a-z\d._-]{1,100})?$")
+
+
+class GitHubWebhooks(object):
+    """
+    Receives GitHub webhook deliveries: verifies their signatures, normalizes
+    them into activity API events and hands them to a background writer through
+    a bounded in-memory queue, which flushes them in batches.
+
+    Where the writer thread cannot run (e.g. uWSGI without --enable-threads),
+    flush() writes the queued events from the request instead. Queued events
+    are lost if the process restarts before they are written.
+    """
+
+    def __init__(self, secret: str = None, queue_size: int = 1000,
+                 batch_size: int = 100, flush_interval: float = 1.0):
+        self.secret = secret
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._worker = None
+        self._running = threading.Event()
+        self._app = None
+        self._handler = None
+        self._warned = False
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.maxsize
+
+    @queue_size.setter
+    def queue_size(self, queue_size: int):
+        self._queue.maxsize = queue_size
+
+    def verify_signature(self, body: bytes, signature: str) -> bool:
+        """Returns whether the X-Hub-Signature-256 header matches the HMAC
+        SHA-256 digest of the request body.
+
+        Deliveries are always rejected if no secret is configured.
+
+        See: https://developer.github.com/webhooks/securing/
+        """
+        if not self.secret or not signature:
+            return False
+        secret = self.secret
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        digest = hmac.new(secret, body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest('sha256=' + digest, signature)
+
+    def normalize(self, event_name: str, delivery_id: str, payload: Dict) -> Dict:
+        """Returns the webhook payload as an activity API event dictionary, or
+        None if the event type or action is not reported by the activity API.
+
+        The webhook payload already contains the fields the event templates
+        read, so only the envelope (sender, repository, organization) needs to
+        be moved into the actor, repo and org fields.
+        """
+        event_type = WEBHOOK_EVENT_TYPES.get(event_name)
+        if event_type is None or not isinstance(payload, dict):
+            return None
+        actions = WEBHOOK_EVENT_ACTIONS.get(event_name)
+        if actions is not None and payload.get('action') not in actions:
+            return None
+        if event_name == 'push' and payload.get('deleted'):
+            # branch deletions are also delivered as 'delete' events
+            return None
+        payload = dict(payload)
+        sender = payload.get('sender') or {}
+        repository = payload.get('repository') or {}
+        organization = payload.get('organization')
+        for key in WEBHOOK_ENVELOPE_KEYS:
+            payload.pop(key, None)
+
+        event = {
+            'id': _event_id(delivery_id),
+            'type': event_type,
+            'actor': {
+                'id': sender.get('id'),
+                'login': sender.get('login'),
+                'display_login': sender.get('login'),
+                'gravatar_id': sender.get('gravatar_id', ''),
+                'url': sender.get('url'),
+                'avatar_url': sender.get('avatar_url'),
+            },
+            'repo': {
+                'id': repository.get('id'),
+                'name': repository.get('full_name'),
+                'url': repository.get('url'),
+            },
+            'payload': payload,
+            'public': not repository.get('private', False),
+            'created_at': _created_at(payload),
+        }
+        if organization:
+            event['org'] = {
+                'id': organization.get('id'),
+                'login': organization.get('login'),
+                'url': organization.get('url'),
+                'avatar_url': organization.get('avatar_url'),
+            }
+        return event
+
+    def enqueue(self, event: Dict) -> bool:
+        """Queues a normalized event for the background writer.
+
+        Returns False without blocking if the queue is full.
+        """
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            logger.warning("Webhook queue full, dropping event %s" % event.get('id'))
+            return False
+        if not self._warned and not self.writer_alive():
+            self._warned = True
+            logger.warning("Webhook writer thread is not running, events are written by flush() instead")
+        return True
+
+    def writer_alive(self) -> bool:
+        """Returns whether the background writer thread is running.
+        """
+        return self._worker is not None and self._worker.is_alive() and self._running.is_set()
+
+    def flush(self):
+        """Writes all queued events synchronously if the writer thread is not
+        running, so that every delivery is written by the request that
+        received it.
+
+        Must be called inside the Flask application context.
+        """
+        if self.writer_alive() or self._handler is None:
+            return
+        while True:
+            batch = self._drain()
+            if not batch:
+                break
+            self._handle(self._handler, batch)
+
+    def start(self, app, handler: Callable[[List[Dict]], None]):
+        """Starts the background writer thread, which calls the handler with
+        batches of queued events inside the Flask application context.
+        """
+        if self._worker is not None:
+            return
+        self._app = app
+        self._handler = handler
+        self._worker = threading.Thread(
+            target=self._run, args=(app, handler), name='webhook-writer', daemon=True)
+        self._worker.start()
+
+    def _run(self, app, handler: Callable[[List[Dict]], None]):
+        self._running.set()
+        while True:
+            batch = self._next_batch()
+            with app.app_context():
+                self._handle(handler, batch)
+
+    def _handle(self, handler: Callable[[List[Dict]], None], batch: List[Dict]):
+        try:
+            handler(batch)
+            return
+        except Exception as e:
+            logger.exception(e)
+        if len(batch) == 1:
+            logger.error("Failed to write webhook event %s" % batch[0].get('id'))
+            return
+        # retry one event at a time so a bad event doesn't drop the rest of the batch
+        logger.warning("Failed to write %d webhook events, retrying individually" % len(batch))
+        for event in batch:
+            self._handle(handler, [event])
+
+    def _drain(self) -> List[Dict]:
+        # take up to a batch of events without blocking
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _next_batch(self) -> List[Dict]:
+        # block for the first event, then collect more until the batch is full
+        # or the flush interval has passed
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+
+def subscription_targets(event: Dict) -> List[str]:
+    """Returns the lowercase repository and organization names that users can
+    subscribe to in order to receive the event.
+    """
+    targets = []
+    repo = event.get('repo') or {}
+    if repo.get('name'):
+        targets.append(repo['name'].lower())
+    org = event.get('org') or {}
+    if org.get('login'):
+        targets.append(org['login'].lower())
+    return targets
+
+
+def validate_subscription_target(target: str) -> bool:
+    """Returns whether the string is a valid lowercase subscription target,
+    i.e. a GitHub user/organization name or 'owner/repo'.
+    """
+    return len(target) <= 140 and SUBSCRIPTION_TARGET_PATTERN.match(target) is not None
+
+
+def feed_event_id(event_id: str, github_id: int) -> str:
+    """Returns the id of a user's copy of the event.
+
+    Each subscriber gets a distinct id, since snoozed events are stored by id.
+    """
+    return _event_id('%s:%s' % (event_id, github_id))
+
+
+def _event_id(delivery_id: str) -> str:
+    # The templates use event ids as numeric JavaScript literals and element
+    # ids, so derive a 52-bit integer (exact as a JS number) from the delivery GUID.
+    digest = hashlib.sha1((delivery_id or '').encode('utf-8')).hexdigest()
+    return str(int(digest[:13], 16))
+
+
+def _created_at(payload: Dict) -> str:
+    # prefer when the event happened, so redeliveries keep their original time
+    for key, field in WEBHOOK_EVENT_TIMESTAMPS:
+        value = payload.get(key)
+        if isinstance(value, dict) and value.get(field):
+            return value[field]
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+# Singleton so it's easier to separate layers
+webhooks = GitHubWebhooks()
@@ -1,12 +1,19 @@
+import json
 import logging
+import dateutil.parser as dt
+from datetime import timezone
+from typing import List, Dict
 from flask import Blueprint, flash, render_template, request, g, session, redirect, url_for, jsonify
 from flask_paginate import Pagination
 
-from service.github import github
+from service.github import github, GITHUB_URL
 from service.github_event_template import github_event_templates, github_event_icons
+from service.webhook import webhooks, subscription_targets, validate_subscription_target, feed_event_id
 from models.db import db
 from models.user import User
 from models.event import Event
+from models.feed_event import FeedEvent
+from models.subscription import Subscription
 
 # Logging
 logger = logging.getLogger(__name__)
@@ -115,6 +122,17 @@ def get_events(target_user: str, user: User, page: int):
     return list(filter(lambda e: e['id'] not in snoozed_events_ids, events)), max_pages
 
 
+def use_virtualized(events: List) -> bool:
+    '''
+    Returns whether the event list should be virtualized, i.e. rendered client-side with only the visible rows
+    in the DOM. Defaults to lists longer than a single page, overridable with the 'virtual' query argument.
+    '''
+    virtual = request.args.get('virtual', type=int)
+    if virtual is not None:
+        return virtual != 0
+    return events is not None and len(events) > github.MAX_EVENTS_PER_PAGE
+
+
 @eventbp.route("/snooze", methods=["POST"])
 def snooze():
     '''Snoozes an event: removes it from the event list and adds it to the user's reminders.
@@ -153,7 +171,7 @@ def unsnooze():
                      (g.user.github_login, str(data)))
         if 'id' not in data:
             raise HTTPException("Malformed event", 400)
-        event = Event.query.get(data['id'])
+        event = Event.query.filter_by(event_id=str(data['id']), github_id=g.user.github_id).first()
         if not event:
             raise HTTPException("No such event found", 404)
         db.session.delete(event)
@@ -165,6 +183,193 @@ def unsnooze():
     return resp
 
 
+def get_subscription_target(data) -> str:
+    '''
+    Returns the lowercase 'owner' or 'owner/repo' target of a subscription request.
+    '''
+    if not isinstance(data, dict) or not isinstance(data.get('target'), str):
+        raise HTTPException("Malformed subscription", 400)
+    target = data['target'].strip().lower()
+    if not validate_subscription_target(target):
+        raise HTTPException("Invalid subscription target '%s'" % target, 400)
+    return target
+
+
+def get_subscriptions(user: User):
+    '''
+    Returns the subscription objects for the user.
+    '''
+    if not user:
+        return []
+    return Subscription.query.filter_by(github_id=user.github_id).order_by(Subscription.target).all()
+
+
+@eventbp.route("/subscribe", methods=["POST"])
+def subscribe():
+    '''Subscribes the user to webhook events from a repository ('owner/repo') or organization.
+    '''
+    if not (request.content_type or '').startswith('application/json'):
+        raise HTTPException("Content type must be application/json")
+    if not g.user:
+        raise HTTPException("Not logged in", 401)
+    target = get_subscription_target(request.json)
+    try:
+        logger.debug("Subscribing user %s to %s" % (g.user.github_login, target))
+        if not Subscription.query.filter_by(github_id=g.user.github_id, target=target).first():
+            db.session.add(Subscription(g.user.github_id, target))
+            db.session.commit()
+    except Exception as e:
+        logger.exception(e)
+        raise HTTPException("failed to subscribe", 500, request.json)
+    resp = jsonify(success=True)
+    return resp
+
+
+@eventbp.route("/unsubscribe", methods=["POST"])
+def unsubscribe():
+    '''Unsubscribes the user from webhook events from a repository or organization.
+    '''
+    if not (request.content_type or '').startswith('application/json'):
+        raise HTTPException("Content type must be application/json")
+    if not g.user:
+        raise HTTPException("Not logged in", 401)
+    target = get_subscription_target(request.json)
+    subscription = Subscription.query.filter_by(github_id=g.user.github_id, target=target).first()
+    if not subscription:
+        raise HTTPException("No such subscription found", 404)
+    try:
+        logger.debug("Unsubscribing user %s from %s" % (g.user.github_login, target))
+        db.session.delete(subscription)
+        db.session.commit()
+    except Exception as e:
+        logger.exception(e)
+        raise HTTPException("failed to unsubscribe", 500, request.json)
+    resp = jsonify(success=True)
+    return resp
+
+
+@eventbp.route("/webhook", methods=["POST"])
+def webhook():
+    '''Receives a GitHub webhook delivery and queues it for the feeds of subscribed users.
+
+    See: https://developer.github.com/webhooks/
+    '''
+    body = request.get_data()
+    if not webhooks.verify_signature(body, request.headers.get('X-Hub-Signature-256')):
+        raise HTTPException("Invalid signature", 401)
+    if not (request.content_type or '').startswith('application/json'):
+        raise HTTPException("Content type must be application/json")
+    event_name = request.headers.get('X-GitHub-Event')
+    delivery_id = request.headers.get('X-GitHub-Delivery')
+    if not event_name or not delivery_id:
+        raise HTTPException("Missing webhook headers", 400)
+    if event_name == 'ping':
+        return jsonify(success=True)
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException("Malformed payload", 400)
+
+    event = webhooks.normalize(event_name, delivery_id, payload)
+    if event is None:
+        # acknowledge unsupported events so GitHub doesn't report failed deliveries
+        logger.debug("Ignoring webhook event '%s'" % event_name)
+        return jsonify(success=True)
+    if not webhooks.enqueue(event):
+        raise HTTPException("Webhook queue full", 503)
+    webhooks.flush()
+    resp = jsonify(success=True)
+    resp.status_code = 202
+    return resp
+
+
+def store_feed_events(events: List[Dict]):
+    '''
+    Fans out a batch of normalized webhook events into the feed of every subscribed user.
+
+    Runs on the webhook writer thread, so everything is fetched and written with one query each.
+
+    Events from private repositories are dropped, since subscribing does not check repository access.
+    '''
+    events = [e for e in events if e.get('public')]
+    if not events:
+        return
+    targets = set()
+    for e in events:
+        targets.update(subscription_targets(e))
+    subscribers = {}
+    for s in Subscription.query.filter(Subscription.target.in_(targets)).all():
+        subscribers.setdefault(s.target, set()).add(s.github_id)
+
+    # each subscriber gets a copy of the event with its own id
+    copies = []
+    for e in events:
+        github_ids = set()
+        for target in subscription_targets(e):
+            github_ids.update(subscribers.get(target, ()))
+        for github_id in github_ids:
+            copies.append((dict(e, id=feed_event_id(e['id'], github_id)), github_id))
+
+    # skip redelivered events
+    event_ids = [e['id'] for e, _ in copies]
+    stored = set((fe.event_id, fe.github_id)
+                 for fe in FeedEvent.query.filter(FeedEvent.event_id.in_(event_ids)).all())
+
+    feed_events = []
+    for e, github_id in copies:
+        if (e['id'], github_id) in stored:
+            continue
+        stored.add((e['id'], github_id))
+        created_at = dt.parse(e['created_at']).astimezone(timezone.utc).replace(tzinfo=None)
+        feed_events.append(FeedEvent(e['id'], e, github_id, created_at))
+    if feed_events:
+        logger.debug("Storing %d webhook feed events" % len(feed_events))
+        try:
+            db.session.add_all(feed_events)
+            db.session.commit()
+        except Exception:
+            # leave the session usable for the writer to retry the events individually
+            db.session.rollback()
+            raise
+
+
+@eventbp.route("/feed", methods=["GET"])
+def feed():
+    '''Displays the webhook events delivered to the logged-in user's subscriptions.
+    '''
+    if not g.user:
+        flash("Login to access your feed")
+        return redirect(url_for('eventbp.index'))
+
+    page = request.args.get('page', type=int, default=1)
+    # build the header from the stored user so the feed spends no API quota
+    user_details = {
+        'login': g.user.github_login,
+        'html_url': "%s/%s" % (GITHUB_URL, g.user.github_login),
+        'avatar_url': "%s/%s.png" % (GITHUB_URL, g.user.github_login),
+    }
+    try:
+        subscriptions = get_subscriptions(g.user)
+        snoozed_events_ids = [se.event_id for se in get_snoozed_events(g.user)]
+        query = FeedEvent.query.filter(FeedEvent.github_id == g.user.github_id,
+                                       ~FeedEvent.event_id.in_(snoozed_events_ids))
+        total = query.count()
+        events_objects = query.order_by(FeedEvent.created_at.desc(), FeedEvent.id.desc()).offset(
+            (page - 1) * github.MAX_EVENTS_PER_PAGE).limit(github.MAX_EVENTS_PER_PAGE).all()
+        feed_events = [e.event_json for e in events_objects]
+        pagination = Pagination(page=page, per_page=github.MAX_EVENTS_PER_PAGE, total=total, css_framework='bootstrap4')
+        return render_template("events.html", events=feed_events, target_user=g.user.github_login,
+                               user_details=user_details, event_templates=github_event_templates,
+                               event_icons=github_event_icons, snoozed=False, logged_in=g.user is not None,
+                               pagination=pagination, virtualized=use_virtualized(feed_events),
+                               subscriptions=subscriptions)
+    except Exception as e:
+        logger.exception(e)
+        flash(str(e))
+        return render_template("events.html", events=None, target_user=g.user.github_login, user_details=None,
+                               snoozed=False, logged_in=g.user is not None, pagination=None, subscriptions=[])
+
+
 @eventbp.route("/events", methods=["GET"])
 def events():
     # TODO: an OAuth token still doesn't retrieve private events?
@@ -187,7 +392,8 @@ def events():
         pagination = Pagination(page=page, per_page=github.MAX_EVENTS_PER_PAGE, total=max_pages*github.MAX_EVENTS_PER_PAGE, css_framework='bootstrap4')
         return render_template("events.html", events=events, target_user=target_user, user_details=user_details,
                                event_templates=github_event_templates, event_icons=github_event_icons,
-                               snoozed=False, logged_in=g.user is not None, pagination=pagination)
+                               snoozed=False, logged_in=g.user is not None, pagination=pagination,
+                               virtualized=use_virtualized(events))
     except Exception as e:
         logger.exception(e)
         flash(str(e))
@@ -211,7 +417,7 @@ def reminders():
         return render_template("events.html", events=snoozed_events, target_user=g.user.github_login,
                                user_details=user_details, event_templates=github_event_templates,
                                event_icons=github_event_icons, snoozed=True, logged_in=g.user is not None,
-                               pagination=None)
+                               pagination=None, virtualized=use_virtualized(snoozed_events))
     except Exception as e:
         logger.exception(e)
         flash(str(e))